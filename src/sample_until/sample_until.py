@@ -1,9 +1,34 @@
 import multiprocessing as mp
+import os
+from array import array
 from itertools import islice
-from typing import Callable, Iterable, Optional
+from multiprocessing.connection import wait
+from typing import Callable, Iterable, Optional, Union
 
-from .stopping_conditions import StoppingCondition, stop
-from .utils import sanitize_inputs
+from .stopping_conditions import (
+    MemoryMonitor,
+    StoppingCondition,
+    compile_stop,
+    create_stopping_conditions,
+    deadline_alarm,
+    sample_limit,
+    stop,
+)
+from .utils import (
+    Channel,
+    Samples,
+    check_chunk_size,
+    get_mp_context,
+    get_pool,
+    new_samples,
+    pool_f_args,
+    sanitize_inputs,
+    split_f_args,
+    worker_cpus,
+)
+
+# Maximum number of samples for which the output is allocated up front
+MAX_PREALLOCATION = 10_000_000
 
 
 def sample_until(
@@ -13,8 +38,12 @@ def sample_until(
     num_samples: Optional[int] = None,
     memory_percentage: Optional[float] = None,
     num_workers: int = 1,
+    chunk_size: Optional[int] = None,
+    output_dtype: Optional[str] = None,
+    reuse_pool: bool = False,
+    pin_workers: bool = False,
     verbose: bool = False,
-) -> list:
+) -> Union[list, array]:
     """
     Run `f` repeatedly until one of the given conditions is met and collect its outputs.
 
@@ -24,6 +53,25 @@ def sample_until(
     e.g., the elapsed time can be slightly longer than `duration_seconds` and the output list
     may contain slightly more or less samples than `num_samples`.
 
+    If `chunk_size` is given, `f` is called with a list of up to `chunk_size` arguments from `f_args`
+    and has to return one sample per argument, e.g., as a list or numpy array.
+    This allows vectorizing `f`. The stopping conditions are checked once per chunk.
+
+    If the samples are numbers, passing their `array` typecode as `output_dtype`, e.g., `"d"` for floats,
+    stores them in an `array.array` instead of a list. This needs much less memory
+    and is faster to send between processes.
+
+    With `reuse_pool=True`, the worker processes are kept alive and reused by later calls
+    with the same `num_workers`, which saves their start-up time when sampling repeatedly.
+    This requires `f` and `f_args` to be picklable, e.g., a module-level function and a list.
+    Other iterables than lists, tuples and ranges are read into a list first,
+    so they have to be finite unless `num_samples` is given.
+    The workers then cannot share `num_samples` and check the memory usage themselves.
+
+    With `pin_workers=True`, every worker process is bound to its own CPU (on Linux),
+    so that its caches are not lost when the operating system moves it to another CPU.
+    It cannot be combined with `reuse_pool=True`.
+
     Args:
         f: Function to sample.
         f_args: Iterable that generates input arguments for `f`.
@@ -31,30 +79,84 @@ def sample_until(
         num_samples: Stop after number of samples acquired.
         memory_percentage: Stop after system memory exceeds percentage, e.g., `0.8`.
         num_workers: Number of processes. Pass `-1` for number of cpus.
+        chunk_size: Call `f` with lists of this many arguments instead of single arguments.
+        output_dtype: Typecode of an `array.array` to collect the samples in.
+        reuse_pool: Keep the worker processes alive for subsequent calls.
+        pin_workers: Bind each worker process to a distinct CPU.
         verbose: Print due to which condition the sampling stopped.
 
     Returns:
-        List of collected samples.
+        List of collected samples, or `array.array` if `output_dtype` is given.
     """
-    f1, f_args, num_workers, stopping_conditions = sanitize_inputs(
+    if chunk_size is not None:
+        check_chunk_size(chunk_size, f_args)
+    if pin_workers and reuse_pool:
+        raise ValueError("pin_workers cannot be combined with reuse_pool")
+    new_samples(output_dtype)  # raises ValueError for invalid typecodes
+    f, f_args, num_workers, stopping_conditions = sanitize_inputs(
         f, f_args, duration_seconds, num_samples, memory_percentage, num_workers
     )
 
     # no multiprocessing
     if num_workers == 1:
-        return _sample_until(f1, f_args, stopping_conditions, verbose)
+        with deadline_alarm(stopping_conditions):
+            return _sample(
+                f, f_args, chunk_size, output_dtype, stopping_conditions, verbose
+            )
+
+    if reuse_pool and f_args is not None:
+        # the shares are pickled for the processes of the pool
+        f_args = pool_f_args(f_args, num_samples)
+    worker_f_args = (
+        [None] * num_workers if f_args is None else split_f_args(f_args, num_workers)
+    )
+
+    # multiprocessing with persistent workers
+    if reuse_pool:
+        pool = get_pool(num_workers)
+        task_args = [
+            (
+                f,
+                worker_f_args[i],
+                stopping_conditions,
+                chunk_size,
+                output_dtype,
+                verbose,
+            )
+            for i in range(num_workers)
+        ]
+        all_samples = new_samples(output_dtype)
+        for local_samples in pool.run(_pooled_worker, task_args):
+            all_samples.extend(local_samples)
+        return all_samples
 
     # multiprocessing
-    manager = mp.Manager()
-    output_queue = manager.Queue()
+    ctx = get_mp_context()
+    # the parent polls the memory usage once for all workers
+    monitor = MemoryMonitor() if memory_percentage is not None else None
+    # Without arguments the workers share the number of samples dynamically,
+    # with `f_args` every worker keeps its fixed share of the arguments.
+    stopping_conditions = create_stopping_conditions(
+        num_workers,
+        duration_seconds,
+        num_samples,
+        memory_percentage,
+        share_num_samples=f_args is None,
+        memory_usage=None if monitor is None else monitor.usage,
+    )
+    cpus = worker_cpus(num_workers) if pin_workers else [None] * num_workers
+    output_queue = ctx.Queue()
     processes = [
-        mp.Process(
+        ctx.Process(
             target=_worker,
             args=(
-                f1,
-                islice(f_args, i, None, num_workers),
+                f,
+                worker_f_args[i],
                 stopping_conditions,
+                chunk_size,
+                output_dtype,
                 output_queue,
+                cpus[i],
                 verbose,
             ),
         )
@@ -63,29 +165,145 @@ def sample_until(
 
     for p in processes:
         p.start()
+    if monitor is not None:
+        monitor.start()
 
-    for p in processes:
-        p.join()
+    try:
+        # gather results before joining, workers exit once their output is consumed
+        all_samples = new_samples(output_dtype)
+        remaining = num_workers
+        running = {p.sentinel: p for p in processes}
+        while remaining > 0:
+            ready = wait([output_queue._reader, *running])
+            if output_queue._reader in ready:
+                all_samples.extend(output_queue.get())
+                remaining -= 1
+                continue
+            # a worker that exits normally has already sent its samples
+            for sentinel in ready:
+                p = running.pop(sentinel)
+                p.join()
+                if p.exitcode != 0:
+                    raise RuntimeError("A worker process died.")
 
-    # Gather results
-    all_samples = output_queue.get()
-    while not output_queue.empty():
-        all_samples.extend(output_queue.get())
+        for p in processes:
+            p.join()
+    finally:
+        if monitor is not None:
+            monitor.stop()
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
 
     return all_samples
 
 
+def _sample(
+    f: Callable,
+    f_args: Optional[Iterable],
+    chunk_size: Optional[int],
+    output_dtype: Optional[str],
+    stopping_conditions: list[StoppingCondition],
+    verbose: bool,
+) -> Samples:
+    """Collect samples of `f` until a stopping condition is met."""
+    if chunk_size is not None:
+        samples = new_samples(output_dtype)
+        return _sample_until_chunked(
+            samples, f, f_args, chunk_size, stopping_conditions, verbose
+        )
+
+    # if the number of samples is known exactly, fill a preallocated container
+    size = _preallocation_size(stopping_conditions)
+    if size > 0:
+        samples = new_samples(output_dtype, size)
+        return _sample_until_preallocated(
+            samples, f, f_args, stopping_conditions, verbose
+        )
+
+    samples = new_samples(output_dtype)
+    if f_args is None:
+        return _sample_until_noargs(samples, f, stopping_conditions, verbose)
+    return _sample_until(samples, f, f_args, stopping_conditions, verbose)
+
+
+def _preallocation_size(stopping_conditions: list[StoppingCondition]) -> int:
+    # with other conditions, `num_samples` is only an upper bound that is rarely reached
+    if len(stopping_conditions) != 1:
+        return 0
+    limit = sample_limit(stopping_conditions)
+    if limit is None or limit > MAX_PREALLOCATION:
+        return 0
+    return limit
+
+
+def _sample_until_preallocated(
+    samples: Samples,
+    f: Callable,
+    f_args: Optional[Iterable],
+    stopping_conditions: list[StoppingCondition],
+    verbose: bool,
+) -> Samples:
+    """Write samples into `samples` whose length is the maximum number of samples."""
+    should_stop = compile_stop(stopping_conditions, verbose)
+    i = 0
+    if f_args is None:
+        # the NumSamples condition stops the loop once `samples` is full
+        while True:
+            samples[i] = f()
+            i += 1
+
+            if should_stop(i):
+                break
+    else:
+        for a in f_args:
+            samples[i] = f(a)
+            i += 1
+
+            if should_stop(i):
+                break
+        else:
+            if verbose:
+                print("Stopped because all f_args were used.")
+
+    del samples[i:]
+    return samples
+
+
+def _sample_until_noargs(
+    samples: Samples,
+    f: Callable,
+    stopping_conditions: list[StoppingCondition],
+    verbose: bool,
+) -> Samples:
+    # local names avoid attribute lookups in the loop
+    append = samples.append
+    should_stop = compile_stop(stopping_conditions, verbose)
+    i = 0
+    while True:
+        append(f())
+        i += 1
+
+        if should_stop(i):
+            return samples
+
+
 def _sample_until(
+    samples: Samples,
     f: Callable,
     f_args: Iterable,
     stopping_conditions: list[StoppingCondition],
     verbose: bool,
-) -> list:
-    samples = []
+) -> Samples:
+    # local names avoid attribute lookups in the loop
+    append = samples.append
+    should_stop = compile_stop(stopping_conditions, verbose)
+    i = 0
     for a in f_args:
-        samples.append(f(a))
+        append(f(a))
+        i += 1
 
-        if stop(stopping_conditions, len(samples), verbose):
+        if should_stop(i):
             return samples
 
     if verbose:
@@ -94,12 +312,89 @@ def _sample_until(
     return samples
 
 
-def _worker(
+def _sample_until_chunked(
+    samples: Samples,
     f: Callable,
     f_args: Iterable,
+    chunk_size: int,
     stopping_conditions: list[StoppingCondition],
+    verbose: bool,
+) -> Samples:
+    # local names avoid attribute lookups in the loop
+    extend = samples.extend
+    should_stop = compile_stop(stopping_conditions, verbose)
+    f_args = iter(f_args)
+    limit = sample_limit(stopping_conditions)
+    if limit is not None:
+        # trim the last chunk instead of overshooting `num_samples`
+        f_args = islice(f_args, limit)
+    i = 0
+    while True:
+        chunk = list(islice(f_args, chunk_size))
+        if len(chunk) == 0:
+            break
+        extend(f(chunk))
+        i += len(chunk)
+
+        if should_stop(i):
+            return samples
+
+    if verbose:
+        print("Stopped because all f_args were used.")
+
+    return samples
+
+
+def _collect(
+    f: Callable,
+    f_args: Optional[Iterable],
+    stopping_conditions: list[StoppingCondition],
+    chunk_size: Optional[int],
+    output_dtype: Optional[str],
+    verbose: bool,
+) -> Samples:
+    """Samples of a single worker process."""
+    # other workers may have already acquired all samples
+    sc = stop(stopping_conditions, 0)
+    if sc is not None:
+        if verbose:
+            print(sc.stop_message())
+        return new_samples(output_dtype)
+    # the worker process has its own timer for the deadline
+    with deadline_alarm(stopping_conditions):
+        return _sample(
+            f, f_args, chunk_size, output_dtype, stopping_conditions, verbose
+        )
+
+
+def _pooled_worker(
+    f: Callable,
+    f_args: Optional[Iterable],
+    stopping_conditions: list[StoppingCondition],
+    chunk_size: Optional[int],
+    output_dtype: Optional[str],
+    verbose: bool,
+    channel: Channel,
+):
+    channel.send(
+        _collect(f, f_args, stopping_conditions, chunk_size, output_dtype, verbose)
+    )
+
+
+def _worker(
+    f: Callable,
+    f_args: Optional[Iterable],
+    stopping_conditions: list[StoppingCondition],
+    chunk_size: Optional[int],
+    output_dtype: Optional[str],
     output: mp.Queue,
+    cpu: Optional[int],
     verbose: bool,
 ):
-    local_samples = _sample_until(f, f_args, stopping_conditions, verbose)
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    local_samples = _collect(
+        f, f_args, stopping_conditions, chunk_size, output_dtype, verbose
+    )
+    # an array is pickled as a single buffer rather than element by element
     output.put(local_samples)
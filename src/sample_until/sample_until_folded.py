@@ -1,16 +1,105 @@
 import multiprocessing as mp
-from itertools import islice
-from typing import Any, Callable, Iterable, Optional
+import time
+from array import array
+from dataclasses import dataclass
+from functools import reduce
+from itertools import islice, repeat, starmap
+from multiprocessing.connection import Connection, wait
+from multiprocessing.context import BaseContext
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence, Union
 from warnings import warn
 
-from .stopping_conditions import StoppingCondition, create_stopping_conditions, stop
-from .utils import check_fold_function, sanitize_inputs
+from .stopping_conditions import (
+    MemoryMonitor,
+    NumSamples,
+    SharedNumSamples,
+    StoppingCondition,
+    compile_stop,
+    create_stopping_conditions,
+    deadline_alarm,
+    sample_limit,
+    stop,
+)
+from .utils import (
+    Channel,
+    check_batch_size,
+    check_fold_function,
+    get_mp_context,
+    get_pool,
+    new_samples,
+    pool_f_args,
+    sanitize_inputs,
+    split_f_args,
+)
+
+# Default number of samples a sampling process sends to the folding process at once
+BATCH_SIZE = 128
+
+# Samples are taken in chunks of up to MAX_CHUNK_SIZE samples that take about
+# CHUNK_DURATION seconds, the stopping conditions are checked between chunks
+MAX_CHUNK_SIZE = 256
+CHUNK_DURATION = 0.001
 
 
 class DoneSignal:
     pass
 
 
+@dataclass
+class PartialFold:
+    """Samples of a sampling process that it has already folded."""
+
+    acc: Any
+    num_samples: int
+
+
+class BatchSlots:
+    """Shared memory slots for sending `array.array` batches to the folding process.
+
+    A sampling process copies its batch into a free slot and only sends the slot index
+    and the batch length to the folding process, instead of pickling the batch.
+    The folding process returns the slot after reading it.
+    The number of slots limits how many batches can be in flight at once.
+    """
+
+    def __init__(
+        self,
+        ctx: BaseContext,
+        output_dtype: str,
+        batch_size: int,
+        num_slots: int,
+    ):
+        self.output_dtype = output_dtype
+        self.slot_size = batch_size * array(output_dtype).itemsize
+        self.memory = SharedMemory(create=True, size=num_slots * self.slot_size)
+        # a SimpleQueue has no feeder thread, which must not run while processes are forked
+        self.free_slots = ctx.SimpleQueue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+
+    def write(self, batch: array) -> tuple[int, int]:
+        """Copy `batch` into a free slot, waiting for one if necessary."""
+        slot = self.free_slots.get()
+        start = slot * self.slot_size
+        data = memoryview(batch).cast("B")
+        self.memory.buf[start : start + len(data)] = data
+        return slot, len(batch)
+
+    def read(self, item: tuple[int, int]) -> array:
+        """Copy the batch out of its slot and free the slot."""
+        slot, length = item
+        start = slot * self.slot_size
+        batch = array(self.output_dtype)
+        batch.frombytes(self.memory.buf[start : start + length * batch.itemsize])
+        self.free_slots.put(slot)
+        return batch
+
+    def release(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
 def folded_sample_until(
     f: Callable,
     fold_function: Callable,
@@ -20,7 +109,10 @@ def folded_sample_until(
     num_samples: Optional[int] = None,
     memory_percentage: Optional[float] = None,
     num_workers: int = 1,
-    batch_size: int = 1,
+    batch_size: int = BATCH_SIZE,
+    output_dtype: Optional[str] = None,
+    reuse_pool: bool = False,
+    fold_is_associative: bool = False,
     verbose: bool = False,
 ) -> tuple[Any, int]:
     """
@@ -37,6 +129,20 @@ def folded_sample_until(
 
     If `num_workers > 1`, there will be `1` folding process and `num_workers - 1` sampling processes
     that send their generated samples to the folding process.
+    If the samples are numbers, passing their `array` typecode as `output_dtype`, e.g., `"d"` for floats,
+    sends them as `array.array` batches through shared memory instead of pickling lists.
+    If `fold_function` can also combine two accumulated values in any order, e.g., a sum or maximum,
+    pass `fold_is_associative=True`. Then the sampling processes fold their own samples
+    and only send their result to the folding process, instead of all samples.
+    Every sampling process starts its fold from `fold_initial`, which therefore has to be
+    the identity of the fold, e.g., `0` for a sum.
+
+    With `reuse_pool=True`, all `num_workers` processes sample and are kept alive for subsequent calls
+    with the same `num_workers`, while the calling process folds the samples.
+    As without the pool, every process gets its own fixed share of `f_args`.
+    This requires `f` and `f_args` to be picklable, e.g., a module-level function and a list.
+    Other iterables than lists, tuples and ranges are read into a list first,
+    so they have to be finite unless `num_samples` is given.
 
     Args:
         f: Function to sample.
@@ -47,13 +153,18 @@ def folded_sample_until(
         num_samples: Stop after number of samples acquired.
         memory_percentage: Stop after system memory exceeds percentage, e.g., `0.8`.
         num_workers: Number of processes. Pass `-1` for number of cpus.
-        batch_size: Only if num_workers > 1: send samples to folding process in batches.
+        batch_size: Only if num_workers > 1: send samples to folding process in batches of this size.
+        output_dtype: Only if num_workers > 1: typecode of the `array.array` batches.
+        reuse_pool: Keep the sampling processes alive for subsequent calls.
+        fold_is_associative: Only if num_workers > 1 and not reuse_pool: fold the samples in the sampling processes.
         verbose: Print due to which condition the sampling stopped.
 
     Returns:
         Accumulated result `acc` and number of iterations.
     """
-    f1, f_args, num_workers, stopping_conditions = sanitize_inputs(
+    check_batch_size(batch_size)
+    new_samples(output_dtype)  # raises ValueError for invalid typecodes
+    f, f_args, num_workers, stopping_conditions = sanitize_inputs(
         f, f_args, duration_seconds, num_samples, memory_percentage, num_workers
     )
 
@@ -62,158 +173,393 @@ def folded_sample_until(
 
     # no multiprocessing
     if num_workers == 1:
-        return _sample_until_folded(
-            f1,
+        with deadline_alarm(stopping_conditions):
+            return _sample_until_folded(
+                f,
+                fold_function,
+                fold_initial,
+                f_args,
+                stopping_conditions,
+                verbose,
+            )
+
+    # multiprocessing with persistent workers
+    if reuse_pool:
+        # the number of samples is divided between the processes by `_fold_pooled`
+        stopping_conditions = create_stopping_conditions(
+            num_workers, duration_seconds, None, memory_percentage
+        )
+        return _fold_pooled(
+            f,
             fold_function,
             fold_initial,
             f_args,
             stopping_conditions,
+            num_samples,
+            num_workers,
+            batch_size,
+            output_dtype,
             verbose,
         )
 
     # multiprocessing
+    ctx = get_mp_context()
     num_workers -= 1  # one process is reserved for the aggregator
-    # recreate stopping conditions because of the new worker count
+    # the parent polls the memory usage once for all workers
+    monitor = MemoryMonitor() if memory_percentage is not None else None
+    # recreate stopping conditions because of the new worker count,
+    # without arguments the workers share the number of samples dynamically
     stopping_conditions = create_stopping_conditions(
-        num_workers, duration_seconds, num_samples, memory_percentage
+        num_workers,
+        duration_seconds,
+        num_samples,
+        memory_percentage,
+        share_num_samples=f_args is None,
+        memory_usage=None if monitor is None else monitor.usage,
+    )
+    # every sampling process sends its batches through its own pipe,
+    # so that they do not compete for a shared queue
+    receivers, senders = zip(*(ctx.Pipe(duplex=False) for _ in range(num_workers)))
+    aggregator_queue = ctx.Queue()
+    worker_f_args = (
+        [None] * num_workers if f_args is None else split_f_args(f_args, num_workers)
+    )
+    # typed batches are sent via shared memory instead of being pickled
+    slots = (
+        None
+        if output_dtype is None
+        else BatchSlots(ctx, output_dtype, batch_size, 2 * num_workers)
     )
-    output_queue = mp.Queue(2 * num_workers)
-    aggregator_queue = mp.Queue()
 
-    processes = [
-        mp.Process(
-            target=_worker,
+    try:
+        processes = [
+            ctx.Process(
+                target=_worker,
+                args=(
+                    f,
+                    worker_f_args[i],
+                    stopping_conditions,
+                    batch_size,
+                    output_dtype,
+                    senders[i],
+                    slots,
+                    fold_function if fold_is_associative else None,
+                    fold_initial,
+                    verbose,
+                ),
+            )
+            for i in range(num_workers)
+        ]
+
+        aggregator = ctx.Process(
+            target=_aggregate,
             args=(
-                f1,
-                islice(f_args, i, None, num_workers),
-                stopping_conditions,
-                batch_size,
-                output_queue,
-                verbose,
+                receivers,
+                aggregator_queue,
+                fold_function,
+                fold_initial,
+                slots,
             ),
         )
-        for i in range(num_workers)
-    ]
-
-    aggregator = mp.Process(
-        target=_aggregate,
-        args=(
-            output_queue,
-            aggregator_queue,
-            fold_function,
-            fold_initial,
-            num_workers,
-        ),
-    )
-    aggregator.start()
-
-    for p in processes:
-        p.start()
+        aggregator.start()
 
-    for p in processes:
-        p.join()
-        output_queue.put(DoneSignal())
+        for p in processes:
+            p.start()
+        if monitor is not None:
+            monitor.start()
 
-    # get output from aggregation process
-    while True:
-        crashed = False
-        warned = False
         try:
-            output = aggregator_queue.get(timeout=20)
-            aggregator.join()
-            return output
-        except:
-            if not aggregator.is_alive():
-                crashed = True
-        if crashed:
-            raise RuntimeError("Folding process crashed!")
-        if not warned:
-            warn_msg = (
-                "Waiting for the folding process to finish. "
-                "If the program does not terminate, check your folding function."
-            )
-            warn(warn_msg, RuntimeWarning)
-            warned = True
+            for p, sender in zip(processes, senders):
+                p.join()
+                if p.exitcode != 0:
+                    # the worker may have been killed before it could signal the folding process,
+                    # a second DoneSignal of a finished worker is ignored
+                    sender.send(DoneSignal())
+        finally:
+            if monitor is not None:
+                monitor.stop()
+
+        # get output from aggregation process
+        while True:
+            crashed = False
+            warned = False
+            try:
+                output = aggregator_queue.get(timeout=20)
+                aggregator.join()
+                return output
+            except:
+                if not aggregator.is_alive():
+                    crashed = True
+            if crashed:
+                raise RuntimeError("Folding process crashed!")
+            if not warned:
+                warn_msg = (
+                    "Waiting for the folding process to finish. "
+                    "If the program does not terminate, check your folding function."
+                )
+                warn(warn_msg, RuntimeWarning)
+                warned = True
+    finally:
+        if slots is not None:
+            slots.release()
 
 
 def _sample_until_folded(
     f: Callable,
     fold_function: Callable,
     fold_initial: Any,
-    f_args: Iterable,
+    f_args: Optional[Iterable],
     stopping_conditions: list[StoppingCondition],
     verbose: bool,
 ):
+    should_stop = compile_stop(stopping_conditions, verbose)
+    limit = sample_limit(stopping_conditions)
+    samples = _outputs(f, f_args)
+    if limit is not None:
+        samples = islice(samples, limit)
+    shared = next(
+        (sc for sc in stopping_conditions if isinstance(sc, SharedNumSamples)), None
+    )
+
+    # Fold chunks of samples with `reduce`, which loops in C,
+    # and check the stopping conditions between chunks.
+    # Chunks grow as long as they take less than CHUNK_DURATION,
+    # so that a slow `f` still checks the conditions after every sample.
     acc = fold_initial
     i = 0
-    for a in f_args:
-        acc = fold_function(acc, f(a))
-        i += 1
+    chunk_size = 1
+    while True:
+        start = time.monotonic()
+        n = chunk_size
+        if shared is not None:
+            n = min(n, shared.claimed_ahead(i))
+        chunk = list(islice(samples, n))
+        if len(chunk) == 0:
+            break
+        acc = reduce(fold_function, chunk, acc)
+        i += len(chunk)
 
-        if stop(stopping_conditions, i, verbose):
+        if should_stop(i):
             return acc, i
+        chunk_size = _adapt_chunk_size(chunk_size, start)
 
     if verbose:
         print("Stopped because all f_args were used.")
     return acc, i
 
 
+def _adapt_chunk_size(chunk_size: int, start: float) -> int:
+    """Size of the next chunk, given the size and start time of the last one."""
+    if time.monotonic() - start < CHUNK_DURATION:
+        return min(2 * chunk_size, MAX_CHUNK_SIZE)
+    return max(chunk_size // 2, 1)
+
+
+def _outputs(f: Callable, f_args: Optional[Iterable]) -> Iterator:
+    """Outputs of `f`, which is called without arguments if `f_args` is None."""
+    if f_args is None:
+        # starmap calls f() directly, without a wrapper that discards an argument
+        return starmap(f, repeat(()))
+    return map(f, f_args)
+
+
+def _fold_pooled(
+    f: Callable,
+    fold_function: Callable,
+    fold_initial: Any,
+    f_args: Optional[Iterable],
+    stopping_conditions: list[StoppingCondition],
+    num_samples: Optional[int],
+    num_workers: int,
+    batch_size: int,
+    output_dtype: Optional[str],
+    verbose: bool,
+):
+    pool = get_pool(num_workers)
+    if f_args is None:
+        worker_f_args = [None] * num_workers
+    else:
+        worker_f_args = split_f_args(pool_f_args(f_args, num_samples), num_workers)
+
+    # every pool process samples its fixed share of the arguments,
+    # so that stateful arguments are never used by two processes at once
+    task_args = []
+    for i in range(num_workers):
+        conditions = list(stopping_conditions)
+        if num_samples is not None:
+            # divide the samples exactly, the shares differ by at most one
+            share = num_samples // num_workers + (i < num_samples % num_workers)
+            if share == 0:
+                continue
+            conditions.append(NumSamples(share))
+        task_args.append(
+            (f, worker_f_args[i], conditions, batch_size, output_dtype, verbose)
+        )
+    # fold the batches as they arrive from the processes
+    acc = fold_initial
+    i = 0
+    for batch in pool.run(_pooled_worker, task_args):
+        acc = reduce(fold_function, batch, acc)
+        i += len(batch)
+    return acc, i
+
+
+def _pooled_worker(
+    f: Callable,
+    f_args: Optional[Iterable],
+    stopping_conditions: list[StoppingCondition],
+    batch_size: int,
+    output_dtype: Optional[str],
+    verbose: bool,
+    channel: Channel,
+):
+    _send_samples(
+        f,
+        f_args,
+        stopping_conditions,
+        batch_size,
+        output_dtype,
+        channel,
+        None,
+        None,
+        None,
+        verbose,
+    )
+
+
 def _aggregate(
-    output_queue: mp.Queue,
+    receivers: Sequence[Connection],
     aggregator_queue: mp.Queue,
     fold_function: Callable,
     fold_initial: Any,
-    num_workers: int,
+    slots: Optional[BatchSlots],
 ):
-    finished_workers = 0
     acc = fold_initial
     i = 0
-    warned = False
-
-    while finished_workers < num_workers:
-        if not warned and output_queue.full():
-            warn_msg = (
-                "Accumulation queue is full! "
-                "This indicates that the folding process can not keep up with the incoming samples. "
-                "The sampling processes have to wait for free slots in the queue."
-            )
-            warn(warn_msg, RuntimeWarning)
-            warned = True
-        item = output_queue.get()
-        if isinstance(item, DoneSignal):
-            finished_workers += 1
-        else:  # item is a batch of samples
+    active = list(receivers)
+
+    while active:
+        for receiver in wait(active):
+            item = receiver.recv()
+            if isinstance(item, DoneSignal):
+                active.remove(receiver)
+                continue
+            if isinstance(item, PartialFold):
+                acc = fold_function(acc, item.acc)
+                i += item.num_samples
+                continue
+            # item is a batch of samples
+            if isinstance(item, tuple):  # batch in a shared memory slot
+                item = slots.read(item)
             i += len(item)
-            for x in item:
-                acc = fold_function(acc, x)
+            acc = reduce(fold_function, item, acc)
 
     aggregator_queue.put((acc, i))
 
 
 def _worker(
     f: Callable,
-    f_args: Iterable,
+    f_args: Optional[Iterable],
     stopping_conditions: list[StoppingCondition],
     batch_size: int,
-    output_queue: mp.Queue,
+    output_dtype: Optional[str],
+    sender: Connection,
+    slots: Optional[BatchSlots],
+    partial_fold: Optional[Callable],
+    fold_initial: Any,
     verbose: bool,
 ):
-    i = 0
-    batch = []
-    for a in f_args:
-        batch.append(f(a))
-        if len(batch) >= batch_size:
-            output_queue.put(batch)
-            batch = []
-        i += 1
-
-        if stop(stopping_conditions, i, verbose):
-            if len(batch) > 0:
-                output_queue.put(batch)
+    try:
+        _send_samples(
+            f,
+            f_args,
+            stopping_conditions,
+            batch_size,
+            output_dtype,
+            sender,
+            slots,
+            partial_fold,
+            fold_initial,
+            verbose,
+        )
+    finally:
+        # signal the folding process directly instead of waiting for the parent
+        sender.send(DoneSignal())
+
+
+def _send_samples(
+    f: Callable,
+    f_args: Optional[Iterable],
+    stopping_conditions: list[StoppingCondition],
+    batch_size: int,
+    output_dtype: Optional[str],
+    sender: Union[Connection, Channel],
+    slots: Optional[BatchSlots],
+    partial_fold: Optional[Callable],
+    fold_initial: Any,
+    verbose: bool,
+):
+    # other workers may have already acquired all samples
+    sc = stop(stopping_conditions, 0)
+    if sc is not None:
+        if verbose:
+            print(sc.stop_message())
+        return
+
+    # the worker process has its own timer for the deadline
+    with deadline_alarm(stopping_conditions):
+        if partial_fold is not None:
+            # every sampling process starts from `fold_initial`, which is the identity
+            acc, i = _sample_until_folded(
+                f, partial_fold, fold_initial, f_args, stopping_conditions, verbose
+            )
+            if i > 0:
+                sender.send(PartialFold(acc, i))
             return
 
-    if verbose:
-        print("Stopped because all f_args were used.")
+        should_stop = compile_stop(stopping_conditions, verbose)
+        # local names avoid attribute lookups in the loop
+        send = sender.send
+        put = send if slots is None else lambda batch: send(slots.write(batch))
+        samples = _outputs(f, f_args)
+        limit = sample_limit(stopping_conditions)
+        if limit is not None:
+            samples = islice(samples, limit)
+        # a shared number of samples may only be exceeded by samples claimed in advance
+        shared = next(
+            (sc for sc in stopping_conditions if isinstance(sc, SharedNumSamples)),
+            None,
+        )
+
+        # Fill a preallocated batch by index, it can be reused after sending
+        # since the pipe pickles it and shared memory slots copy it right away.
+        # The stopping conditions are checked between chunks as in `_sample_until_folded`.
+        i = 0
+        j = 0
+        batch = new_samples(output_dtype, batch_size)
+        chunk_size = 1
+        while True:
+            start = time.monotonic()
+            n = min(chunk_size, batch_size - j)
+            if shared is not None:
+                n = min(n, shared.claimed_ahead(i))
+            chunk_start = j
+            for x in islice(samples, n):
+                batch[j] = x
+                j += 1
+            if j == chunk_start:
+                if verbose:
+                    print("Stopped because all f_args were used.")
+                break
+            i += j - chunk_start
+            if j == batch_size:
+                put(batch)
+                j = 0
+
+            if should_stop(i):
+                break
+            chunk_size = _adapt_chunk_size(chunk_size, start)
 
-    if len(batch) > 0:
-        output_queue.put(batch)
+        if j > 0:
+            del batch[j:]
+            put(batch)
@@ -1,9 +1,22 @@
+import multiprocessing as mp
+import signal
+import threading
 import time
-from dataclasses import dataclass
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from math import ceil
-from typing import Optional, Protocol
+from multiprocessing.sharedctypes import Synchronized
+from typing import Any, Callable, Iterator, Optional, Protocol
 
-import psutil
+# Maximum number of samples a process claims at once from a shared budget
+CLAIM_SIZE = 64
+
+# Seconds between two checks of the system memory usage
+MONITOR_INTERVAL = 0.1
+
+# Number of samples after which the clock is read even though the deadline is signaled
+# via SIGALRM, since `f` may cancel the timer, e.g., with `signal.alarm(0)`
+CLOCK_CHECK_INTERVAL = 32
 
 
 class StoppingCondition(Protocol):
@@ -19,48 +32,190 @@ def create_stopping_conditions(
     duration_seconds: Optional[float],
     num_samples: Optional[int],
     memory_percentage: Optional[float],
+    share_num_samples: bool = False,
+    memory_usage: Optional[Any] = None,
 ) -> list[StoppingCondition]:
     stopping_conditions = []
     if duration_seconds is not None:
-        stopping_conditions.append(TimeElapsed(time.time(), duration_seconds))
-    if num_samples is not None:
+        stopping_conditions.append(TimeElapsed(time.monotonic(), duration_seconds))
+    if num_samples is not None and share_num_samples and num_workers > 1:
+        # workers claim samples from a shared budget
+        budget = mp.Value("q", num_samples)
+        stopping_conditions.append(SharedNumSamples(budget, num_workers))
+    elif num_samples is not None:
         # divide samples between workers
         num_samples = ceil(num_samples / num_workers)
         stopping_conditions.append(NumSamples(num_samples))
     if memory_percentage is not None:
-        stopping_conditions.append(MemoryPercentage(memory_percentage))
+        stopping_conditions.append(MemoryPercentage(memory_percentage, memory_usage))
     return stopping_conditions
 
 
 def stop(
-    stopping_conditions: list[StoppingCondition],
-    num_samples: int,
-    verbose: bool = False,
-) -> bool:
+    stopping_conditions: list[StoppingCondition], num_samples: int
+) -> Optional[StoppingCondition]:
+    """The first condition that is met, or None."""
     for sc in stopping_conditions:
         if sc.stop(num_samples):
-            if verbose:
-                print(sc.stop_message())
-            return True
-    return False
+            return sc
+    return None
+
+
+def sample_limit(stopping_conditions: list[StoppingCondition]) -> Optional[int]:
+    """Maximum number of samples set by a `NumSamples` condition, if any."""
+    limits = [
+        sc.num_samples for sc in stopping_conditions if isinstance(sc, NumSamples)
+    ]
+    return min(limits, default=None)
+
+
+def compile_stop(
+    stopping_conditions: list[StoppingCondition], verbose: bool = False
+) -> Callable[[int], bool]:
+    """Create a predicate `should_stop(num_samples)` for the given conditions.
+
+    Returns whether `stop(stopping_conditions, num_samples)` finds a met condition
+    and prints its message if `verbose`, but is specialized to the conditions of the run:
+    the number of samples and the deadline are compared inline
+    and conditions that are not set do not cost anything.
+    Create the predicate inside `deadline_alarm`, so that it reads the alarm flag
+    and only reads the clock every CLOCK_CHECK_INTERVAL samples.
+    """
+    count = next((sc for sc in stopping_conditions if isinstance(sc, NumSamples)), None)
+    timer = next(
+        (sc for sc in stopping_conditions if isinstance(sc, TimeElapsed)), None
+    )
+    others = tuple(sc for sc in stopping_conditions if sc is not count)
+
+    def stopped(sc: StoppingCondition) -> bool:
+        if verbose:
+            print(sc.stop_message())
+        return True
+
+    if not others:
+        if count is None:
+            return lambda _: False
+        target = count.num_samples
+        return lambda num_samples: num_samples >= target and stopped(count)
+
+    if others == (timer,):
+        # bind everything as default arguments, which are the fastest to access
+        target = count.num_samples if count is not None else float("inf")
+        if timer._alarm:
+            next_check = [CLOCK_CHECK_INTERVAL]
+
+            def should_stop(
+                num_samples: int,
+                target=target,
+                timer=timer,
+                next_check=next_check,
+                deadline=timer._deadline,
+                clock=time.monotonic,
+            ) -> bool:
+                if num_samples >= target:
+                    return stopped(count)
+                if timer._expired:
+                    return stopped(timer)
+                if num_samples < next_check[0]:
+                    return False
+                # the flag is never set if `f` cancelled the timer
+                next_check[0] = num_samples + CLOCK_CHECK_INTERVAL
+                return clock() >= deadline and stopped(timer)
+
+        else:
+
+            def should_stop(
+                num_samples: int,
+                target=target,
+                deadline=timer._deadline,
+                clock=time.monotonic,
+            ) -> bool:
+                if num_samples >= target:
+                    return stopped(count)
+                return clock() >= deadline and stopped(timer)
+
+        return should_stop
+
+    if count is None and len(others) == 1:
+        (sc,) = others
+        sc_stop = sc.stop
+        return lambda num_samples: sc_stop(num_samples) and stopped(sc)
+
+    target = count.num_samples if count is not None else float("inf")
+    # bind the checks once instead of looking them up on every call
+    checks = tuple((sc.stop, sc) for sc in others)
+
+    def should_stop(num_samples: int) -> bool:
+        if num_samples >= target:
+            return stopped(count)
+        for sc_stop, sc in checks:
+            if sc_stop(num_samples):
+                return stopped(sc)
+        return False
+
+    return should_stop
 
 
 @dataclass
 class TimeElapsed:
     start_time: float
     duration_seconds: float
+    _deadline: float = field(init=False, repr=False)
+    # set by `deadline_alarm`, which makes most clock reads unnecessary
+    _alarm: bool = field(default=False, init=False, repr=False)
+    _expired: bool = field(default=False, init=False, repr=False)
 
     def __post_init__(self):
         if self.duration_seconds <= 0:
             raise ValueError("duration_seconds has to be > 0")
+        self._deadline = self.start_time + self.duration_seconds
 
-    def stop(self, _: list) -> bool:
-        return (time.time() - self.start_time) >= self.duration_seconds
+    def stop(self, _: int) -> bool:
+        # the clock is still read with an alarm, which `f` may have cancelled
+        return self._expired or time.monotonic() >= self._deadline
 
     def stop_message(self) -> str:
         return "Stopped because time elapsed."
 
 
+@contextmanager
+def deadline_alarm(stopping_conditions: list[StoppingCondition]) -> Iterator[None]:
+    """Signal the end of `TimeElapsed` via a SIGALRM timer while the context is active.
+
+    The predicate of `compile_stop` then mostly reads a flag instead of the clock.
+    Only used in the main thread on platforms with `signal.setitimer`
+    and if SIGALRM is not already in use, otherwise the clock is read as usual.
+    """
+    timer = next(
+        (sc for sc in stopping_conditions if isinstance(sc, TimeElapsed)), None
+    )
+    if (
+        timer is None
+        or not hasattr(signal, "setitimer")
+        or threading.current_thread() is not threading.main_thread()
+        or signal.getsignal(signal.SIGALRM) is not signal.SIG_DFL
+        or signal.getitimer(signal.ITIMER_REAL)[0] > 0
+    ):
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        timer._expired = True
+
+    remaining = timer._deadline - time.monotonic()
+    signal.signal(signal.SIGALRM, on_alarm)
+    try:
+        timer._expired = remaining <= 0
+        timer._alarm = True
+        if remaining > 0:
+            signal.setitimer(signal.ITIMER_REAL, remaining)
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        timer._alarm = False
+
+
 @dataclass
 class NumSamples:
     num_samples: int
@@ -76,16 +231,105 @@ class NumSamples:
         return "Stopped because number of samples reached."
 
 
+@dataclass
+class SharedNumSamples:
+    """Number of samples shared between processes.
+
+    Each process claims chunks of the remaining samples, so that faster processes
+    acquire more samples than slower ones and the total is met exactly.
+    """
+
+    remaining: Synchronized
+    num_workers: int
+    _claimed: int = field(default=0, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.remaining.value <= 0:
+            raise ValueError("num_samples has to be > 0")
+
+    def stop(self, num_samples: int) -> bool:
+        # make sure that the next sample is covered by a claim
+        while self._claimed <= num_samples:
+            claimed = self._claim()
+            if claimed == 0:
+                return True
+            self._claimed += claimed
+        return False
+
+    def claimed_ahead(self, num_samples: int) -> int:
+        """Number of samples after the first `num_samples` that are already claimed."""
+        return self._claimed - num_samples
+
+    def _claim(self) -> int:
+        # claim smaller chunks towards the end so that all processes finish together
+        with self.remaining.get_lock():
+            remaining = self.remaining.value
+            claimed = min(
+                remaining, CLAIM_SIZE, max(1, remaining // (2 * self.num_workers))
+            )
+            self.remaining.value = remaining - claimed
+        return claimed
+
+    def stop_message(self) -> str:
+        return "Stopped because number of samples reached."
+
+
 @dataclass
 class MemoryPercentage:
     memory_percentage: float
+    # shared memory usage provided by a MemoryMonitor, polled directly if None
+    usage: Optional[Any] = None
+    _next_poll: float = field(default=0.0, init=False, repr=False)
+    _exceeded: bool = field(default=False, init=False, repr=False)
 
     def __post_init__(self):
         if self.memory_percentage < 0 or self.memory_percentage > 1:
             raise ValueError("memory_percentage has to be between 0 and 1")
 
-    def stop(self, _: list) -> bool:
-        return psutil.virtual_memory()[2] / 100.0 >= self.memory_percentage
+    def stop(self, num_samples: int) -> bool:
+        if self.usage is not None:
+            return self.usage.value >= self.memory_percentage
+        # reading the memory usage is expensive, only poll every MONITOR_INTERVAL seconds
+        now = time.monotonic()
+        if now >= self._next_poll:
+            self._next_poll = now + MONITOR_INTERVAL
+            self._exceeded = memory_usage() >= self.memory_percentage
+        return self._exceeded
 
     def stop_message(self) -> str:
         return "Stopped because memory usage exceeded."
+
+
+class MemoryMonitor:
+    """Polls the system memory usage in a background thread.
+
+    The usage is shared with worker processes via `usage`, so that the workers
+    do not have to read it themselves.
+    Start the monitor after the workers, since forking a process with
+    running threads is unsafe.
+    """
+
+    def __init__(self):
+        self.usage = mp.RawValue("d", memory_usage())
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _poll(self):
+        while not self._stopped.wait(MONITOR_INTERVAL):
+            self.usage.value = memory_usage()
+
+
+def memory_usage() -> float:
+    """Fraction of the system memory that is in use."""
+    # imported lazily, so that runs without a memory condition do not load psutil
+    import psutil
+
+    return psutil.virtual_memory().percent / 100.0
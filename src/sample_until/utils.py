@@ -1,11 +1,31 @@
+import atexit
 import inspect
 import itertools
 import multiprocessing as mp
-from typing import Callable, Iterable, Optional, Sized
+import os
+import sys
+import types
+import weakref
+from array import array
+from dataclasses import dataclass
+from multiprocessing.connection import Connection, wait
+from multiprocessing.context import BaseContext
+from typing import Any, Callable, Iterable, Iterator, Optional, Sized, Union
 from warnings import warn
 
 from .stopping_conditions import StoppingCondition, create_stopping_conditions
 
+Samples = Union[list, array]
+
+# worker pools kept alive between calls, by number of workers
+_POOLS: dict[int, "WorkerPool"] = {}
+
+# inspecting the signature is slow, it is cached for repeated calls with the same function,
+# the weak keys do not keep the functions alive
+_NUM_REQUIRED_ARGS: "weakref.WeakKeyDictionary[Callable, int]" = (
+    weakref.WeakKeyDictionary()
+)
+
 
 def sanitize_inputs(
     f: Callable,
@@ -14,21 +34,15 @@ def sanitize_inputs(
     num_samples: Optional[int],
     memory_percentage: Optional[float],
     num_workers: int,
-) -> tuple[Callable, Iterable, int, list[StoppingCondition]]:
+) -> tuple[Callable, Optional[Iterable], int, list[StoppingCondition]]:
     """Sanitize and check inputs, and create stopping conditions.
 
     Throws an error if the inputs are invalid.
+    `f` and `f_args` are returned unchanged, `f` is called without arguments if `f_args` is None.
     """
     # Check if f accepts a valid number of arguments
     _check_f_valid(f, f_args)
 
-    # Replace f with a function f1 that always accepts one argument
-    if f_args is None:
-        f_args = itertools.repeat(None)
-        f1 = lambda _: f()
-    else:
-        f1 = f
-
     # Check and set num_workers
     num_workers = _set_num_workers(num_workers)
 
@@ -39,7 +53,165 @@ def sanitize_inputs(
     # Check that at least one stopping condition is provided
     _check_stopping_conditions(stopping_conditions, f_args)
 
-    return f1, f_args, num_workers, stopping_conditions
+    return f, f_args, num_workers, stopping_conditions
+
+
+def get_mp_context() -> BaseContext:
+    """Multiprocessing context used for starting the worker processes.
+
+    On Linux the workers are forked: they start without launching a new interpreter
+    and share `f` and `f_args` without pickling them.
+    Other platforms use their default start method, since forking is unsafe on macOS
+    and unavailable on Windows.
+    """
+    if sys.platform.startswith("linux"):
+        return mp.get_context("fork")
+    return mp.get_context()
+
+
+def get_pool(num_workers: int) -> "WorkerPool":
+    """Pool of `num_workers` processes that is reused by subsequent calls.
+
+    The pools are shut down when the interpreter exits.
+    """
+    pool = _POOLS.get(num_workers)
+    if pool is None or pool.broken:
+        pool = WorkerPool(num_workers)
+        _POOLS[num_workers] = pool
+    return pool
+
+
+@atexit.register
+def _shutdown_pools():
+    for pool in _POOLS.values():
+        pool.shutdown()
+    _POOLS.clear()
+
+
+class Channel:
+    """Sending end of a pipe that is shared by several processes."""
+
+    def __init__(self, connection: Connection, lock):
+        self.connection = connection
+        self.lock = lock
+
+    def send(self, obj: Any):
+        with self.lock:
+            self.connection.send(obj)
+
+
+@dataclass
+class TaskDone:
+    """Sent by a pool process after a task, with the exception the task raised, if any."""
+
+    error: Optional[BaseException] = None
+
+
+class WorkerPool:
+    """Processes that are kept alive to run the tasks of subsequent calls.
+
+    The processes are started via `forkserver` (or `spawn` where it is not available)
+    and the pool runs no threads in the calling process,
+    so that later calls can still fork their workers safely.
+    Tasks and their arguments therefore have to be picklable.
+    """
+
+    def __init__(self, num_workers: int):
+        if "forkserver" in mp.get_all_start_methods():
+            ctx = mp.get_context("forkserver")
+        else:
+            ctx = mp.get_context("spawn")
+        self.broken = False
+        self._tasks = ctx.SimpleQueue()
+        self._results, sender = ctx.Pipe(duplex=False)
+        # kept alive, since the processes may unpickle the lock after `start` returned
+        self._channel = Channel(sender, ctx.Lock())
+        self._processes = [
+            ctx.Process(
+                target=_run_tasks, args=(self._tasks, self._channel), daemon=True
+            )
+            for _ in range(num_workers)
+        ]
+        for p in self._processes:
+            p.start()
+
+    def run(self, task: Callable, task_args: list[tuple]) -> Iterator[Any]:
+        """Run `task(*args, channel)` for all `args` in `task_args` in the pool
+        and yield the messages the tasks send via `channel.send` until all tasks are done.
+
+        Raises the first exception of a task after all tasks are done.
+        If the messages are not consumed completely, the pool is shut down.
+        """
+        remaining = 0
+        error = None
+        sentinels = [p.sentinel for p in self._processes]
+        try:
+            for args in task_args:
+                self._tasks.put((task, args))
+                remaining += 1
+            while remaining > 0:
+                if self._results not in wait([self._results, *sentinels]):
+                    raise RuntimeError("A process of the worker pool died.")
+                message = self._results.recv()
+                if isinstance(message, TaskDone):
+                    remaining -= 1
+                    error = error or message.error
+                else:
+                    yield message
+        finally:
+            if remaining > 0:
+                # messages of unfinished tasks would be received by the next call
+                self.broken = True
+                self.terminate()
+        if error is not None:
+            raise error
+
+    def shutdown(self):
+        for _ in self._processes:
+            self._tasks.put(None)
+        for p in self._processes:
+            p.join(timeout=1)
+        self.terminate()
+
+    def terminate(self):
+        for p in self._processes:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+
+
+def _run_tasks(tasks, channel: Channel):
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_function, args = task
+        try:
+            task_function(*args, channel)
+        except Exception as e:
+            channel.send(TaskDone(e))
+        else:
+            channel.send(TaskDone())
+
+
+def new_samples(output_dtype: Optional[str], size: int = 0) -> Samples:
+    """Container for `size` samples, filled with placeholders."""
+    if output_dtype is None:
+        return [None] * size
+    samples = array(output_dtype)
+    samples.frombytes(bytes(size * samples.itemsize))
+    return samples
+
+
+def worker_cpus(num_workers: int) -> list[Optional[int]]:
+    """Distinct CPUs to pin the workers to, or `None` if pinning is not supported.
+
+    Workers are assigned round-robin to the CPUs available to this process.
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        return [None] * num_workers
+    cpus = sorted(os.sched_getaffinity(0))
+    return [cpus[i % len(cpus)] for i in range(num_workers)]
 
 
 def check_fold_function(fold_function: Callable):
@@ -52,6 +224,41 @@ def check_fold_function(fold_function: Callable):
         raise ValueError("fold_function must accept exactly 2 arguments.")
 
 
+def split_f_args(f_args: Iterable, num_workers: int) -> list[Iterable]:
+    """Divide `f_args` between the workers.
+
+    The i-th worker gets every `num_workers`-th argument, starting with the i-th.
+    Lists, tuples and ranges are sliced directly, so that a worker does not have to step over
+    the arguments of the other workers.
+    """
+    if isinstance(f_args, (list, tuple, range)):
+        return [f_args[i::num_workers] for i in range(num_workers)]
+    return [itertools.islice(f_args, i, None, num_workers) for i in range(num_workers)]
+
+
+def pool_f_args(f_args: Iterable, num_samples: Optional[int]) -> Iterable:
+    """`f_args` in a form that can be split and pickled for the processes of a pool.
+
+    Other iterables than lists, tuples and ranges are read into a list first,
+    up to `num_samples` arguments.
+    """
+    if isinstance(f_args, (list, tuple, range)):
+        return f_args
+    return list(itertools.islice(f_args, num_samples))
+
+
+def check_chunk_size(chunk_size: int, f_args: Optional[Iterable]):
+    if chunk_size <= 0:
+        raise ValueError("chunk_size has to be >= 1")
+    if f_args is None:
+        raise ValueError("chunk_size requires f_args")
+
+
+def check_batch_size(batch_size: int):
+    if batch_size <= 0:
+        raise ValueError("batch_size has to be >= 1")
+
+
 def _check_f_valid(f: Callable, f_args: Optional[Iterable]):
     num_args = -1
     try:
@@ -69,7 +276,8 @@ def _check_f_valid(f: Callable, f_args: Optional[Iterable]):
 
 def _set_num_workers(num_workers: int) -> int:
     if num_workers == -1:
-        return mp.cpu_count()
+        # unlike `mp.cpu_count`, `os.cpu_count` returns None if the count is unknown
+        return os.cpu_count() or 1
     if num_workers <= 0:
         raise ValueError("num_workers has to be >= 1")
     return num_workers
@@ -95,6 +303,31 @@ def _num_required_args(func: Callable) -> int:
 
     Raises an Exception if the signature of `func` cannot be inspected.
     """
+    try:
+        return _NUM_REQUIRED_ARGS[func]
+    # not cached yet, or func is not hashable or weakly referenceable
+    except (KeyError, TypeError):
+        pass
+    num_args = _count_required_args(func)
+    try:
+        _NUM_REQUIRED_ARGS[func] = num_args
+    except TypeError:
+        pass
+    return num_args
+
+
+def _count_required_args(func: Callable) -> int:
+    # plain functions can be read from their code object, much faster than `inspect`
+    if (
+        isinstance(func, types.FunctionType)
+        and not hasattr(func, "__wrapped__")
+        and not hasattr(func, "__signature__")
+    ):
+        code = func.__code__
+        num_positional = code.co_argcount - len(func.__defaults__ or ())
+        num_keyword = code.co_kwonlyargcount - len(func.__kwdefaults__ or {})
+        return num_positional + num_keyword
+
     sig = inspect.signature(func)
     params = sig.parameters.values()
 
@@ -1,4 +1,5 @@
 import time
+from collections import deque
 from itertools import count, cycle, repeat
 
 import pytest
@@ -32,11 +33,27 @@ def test_f_args_stop_num_samples(f_args):
     assert samples == [i for i in range(50)]
 
 
+def test_f_args_stop_before_num_samples():
+    # the output is allocated for num_samples and truncated afterwards
+    samples = sample_until(sample, f_args=range(20), num_samples=50)
+    assert samples == [i for i in range(20)]
+
+
 def test_f_args_multiprocessing_stop_sized(f_args):
     samples = sample_until(sample, f_args=f_args, num_workers=4)
     assert set(samples) == set(range(100))  # the order of elements varies
 
 
+def test_f_args_multiprocessing_list():
+    samples = sample_until(sample, f_args=list(range(100)), num_workers=4)
+    assert sorted(samples) == [i for i in range(100)]
+
+
+def test_f_args_multiprocessing_deque():
+    samples = sample_until(sample, f_args=deque(range(10)), num_workers=2)
+    assert sorted(samples) == [i for i in range(10)]
+
+
 def test_f_args_multiprocessing_stop_num_samples(f_args):
     samples = sample_until(sample, f_args=f_args, num_samples=40, num_workers=4)
     assert set(samples) == set(range(40))  # the order of elements varies
@@ -59,6 +76,36 @@ def test_f_args_all_conditions(f_args):
     assert set(samples) == set(range(40))  # the order of elements varies
 
 
+def sample_chunk(xs):
+    return [x for x in xs]
+
+
+def test_f_args_chunk_size(f_args):
+    samples = sample_until(sample_chunk, f_args=f_args, chunk_size=16)
+    assert samples == [i for i in range(100)]
+
+
+def test_f_args_chunk_size_num_samples():
+    # the last chunk is trimmed to the number of samples
+    samples = sample_until(
+        sample_chunk, f_args=range(1000), num_samples=50, chunk_size=32
+    )
+    assert samples == list(range(50))
+
+
+def test_f_args_chunk_size_multiprocessing(f_args):
+    samples = sample_until(sample_chunk, f_args=f_args, chunk_size=8, num_workers=4)
+    assert sorted(samples) == [i for i in range(100)]
+
+
+def test_f_args_chunk_size_errors(f_args):
+    with pytest.raises(ValueError):
+        sample_until(sample_chunk, f_args=f_args, chunk_size=0)
+
+    with pytest.raises(ValueError):
+        sample_until(lambda: 1, num_samples=10, chunk_size=8)
+
+
 def test_f_args_error_no_stopping_condition():
     with pytest.raises(ValueError):
         sample_until(sample, repeat(1))
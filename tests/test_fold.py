@@ -1,3 +1,8 @@
+import random
+import signal
+import time
+from collections import deque
+
 import pytest
 
 from sample_until import folded_sample_until
@@ -16,6 +21,27 @@ def fold_sum(acc, x):
     return acc + x
 
 
+def one():
+    return 1
+
+
+def sample_random(rng):
+    return rng.random()
+
+
+def fold_add(acc, x):
+    acc.add(x)
+    return acc
+
+
+def sample_with_alarm_guard():
+    # a common timeout guard, which cancels any other timer
+    signal.alarm(10)
+    time.sleep(0.001)
+    signal.alarm(0)
+    return 1
+
+
 def test_fold(f_args):
     out = folded_sample_until(sample, fold_sum, 10, f_args=f_args)
     assert out == (100 * 99 / 2 + 10, 100)
@@ -31,6 +57,20 @@ def test_fold_multiprocessing(f_args):
     assert out == (100 * 99 / 2 + 10, 100)
 
 
+def test_fold_multiprocessing_list():
+    out = folded_sample_until(
+        sample, fold_sum, 10, f_args=list(range(100)), num_workers=4
+    )
+    assert out == (100 * 99 / 2 + 10, 100)
+
+
+def test_fold_multiprocessing_deque():
+    out = folded_sample_until(
+        sample, fold_sum, 10, f_args=deque(range(100)), num_workers=4
+    )
+    assert out == (100 * 99 / 2 + 10, 100)
+
+
 def test_fold_multiprocessing_stop_num_samples(f_args):
     out = folded_sample_until(
         sample, fold_sum, 10, f_args=f_args, num_samples=30, num_workers=4
@@ -45,9 +85,121 @@ def test_fold_multiprocessing_batches(f_args):
     assert out == (100 * 99 / 2 + 10, 100)
 
 
+def test_fold_multiprocessing_output_dtype(f_args):
+    out = folded_sample_until(
+        sample, fold_sum, 10, f_args=f_args, num_workers=4, output_dtype="q"
+    )
+    assert out == (100 * 99 / 2 + 10, 100)
+
+
+def test_fold_multiprocessing_reuse_pool(f_args):
+    out = folded_sample_until(
+        sample, fold_sum, 10, f_args=f_args, num_workers=4, reuse_pool=True
+    )
+    assert out == (100 * 99 / 2 + 10, 100)
+    # the second call runs on the same processes
+    out = folded_sample_until(
+        sample,
+        fold_sum,
+        10,
+        f_args=range(100),
+        num_samples=30,
+        num_workers=4,
+        reuse_pool=True,
+    )
+    assert out == (30 * 29 / 2 + 10, 30)
+
+
+def test_fold_multiprocessing_reuse_pool_stateful_f_args():
+    # each generator is used by a single process, which draws distinct numbers from it
+    rngs = [random.Random(i) for i in range(4)] * 500
+    out = folded_sample_until(
+        sample_random,
+        fold_add,
+        set(),
+        f_args=rngs,
+        num_samples=2000,
+        num_workers=4,
+        batch_size=16,
+        reuse_pool=True,
+    )
+    assert len(out[0]) == out[1] == 2000
+
+
+def test_fold_multiprocessing_reuse_pool_fewer_samples_than_workers():
+    # workers without a share of the samples do not get a task
+    out = folded_sample_until(
+        sample,
+        fold_sum,
+        0,
+        f_args=list(range(100)),
+        num_samples=2,
+        num_workers=4,
+        reuse_pool=True,
+    )
+    assert out == (1, 2)
+    out = folded_sample_until(
+        one, fold_sum, 0, num_samples=2, num_workers=4, reuse_pool=True
+    )
+    assert out == (2, 2)
+
+
+def test_fold_multiprocessing_associative(f_args):
+    # `fold_initial` is the identity, since every sampling process starts from it
+    out = folded_sample_until(
+        sample, fold_sum, 0, f_args=f_args, num_workers=4, fold_is_associative=True
+    )
+    assert out == (100 * 99 / 2, 100)
+    out = folded_sample_until(
+        lambda: 1, fold_sum, 0, num_samples=101, num_workers=3, fold_is_associative=True
+    )
+    assert out == (101, 101)
+
+
+def fold_batch_sum(acc, x):
+    # `x` is a batch of samples, or the result of another sampling process
+    return acc + (sum(x) if isinstance(x, list) else x)
+
+
+def test_fold_multiprocessing_associative_batches():
+    # every sampling process starts from `fold_initial` instead of its first batch
+    out = folded_sample_until(
+        lambda: [1, 2],
+        fold_batch_sum,
+        0,
+        num_samples=100,
+        num_workers=3,
+        fold_is_associative=True,
+    )
+    assert out == (300, 100)
+
+
+def test_fold_multiprocessing_shared_num_samples():
+    out = folded_sample_until(lambda: 1, fold_sum, 0, num_samples=101, num_workers=3)
+    assert out == (101, 101)
+
+
+@pytest.mark.skipif(not hasattr(signal, "setitimer"), reason="requires setitimer")
+def test_fold_multiprocessing_time_elapsed_cancelled_alarm():
+    start = time.time()
+    acc, n = folded_sample_until(
+        sample_with_alarm_guard, fold_sum, 0, duration_seconds=0.2, num_workers=3
+    )
+    elapsed = time.time() - start
+    assert 0.2 < elapsed < 1.0
+    assert acc == n > 0
+
+
 def test_fold_invalid_fold_function(f_args):
     def invalid_fold(acc):
         return acc
 
     with pytest.raises(ValueError):
         folded_sample_until(sample, invalid_fold, 0, f_args=f_args)
+
+
+def test_fold_invalid_batch_size(f_args):
+    with pytest.raises(ValueError):
+        folded_sample_until(sample, fold_sum, 0, f_args=f_args, batch_size=0)
+    with pytest.raises(ValueError):
+        folded_sample_until(sample, fold_sum, 0, f_args=f_args, batch_size=-1)
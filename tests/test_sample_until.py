@@ -1,4 +1,7 @@
+import signal
 import time
+import tracemalloc
+from array import array
 
 import pytest
 
@@ -10,6 +13,22 @@ def sample():
     return 1
 
 
+def sample_arg(x):
+    return x
+
+
+def fail():
+    raise ZeroDivisionError
+
+
+def sample_with_alarm_guard():
+    # a common timeout guard, which cancels any other timer
+    signal.alarm(10)
+    time.sleep(0.001)
+    signal.alarm(0)
+    return 1
+
+
 def test_sample_until_time_elapsed_one_worker():
     start = time.time()
     samples = sample_until(sample, duration_seconds=2)
@@ -19,6 +38,24 @@ def test_sample_until_time_elapsed_one_worker():
     assert 150 <= len(samples) <= 200
 
 
+@pytest.mark.skipif(not hasattr(signal, "setitimer"), reason="requires setitimer")
+def test_sample_until_time_elapsed_restores_alarm():
+    # the deadline is signaled via SIGALRM, which has to be reset afterwards
+    samples = sample_until(sample, duration_seconds=0.2)
+    assert 10 <= len(samples) <= 20
+    assert signal.getsignal(signal.SIGALRM) is signal.SIG_DFL
+    assert signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0)
+
+
+@pytest.mark.skipif(not hasattr(signal, "setitimer"), reason="requires setitimer")
+def test_sample_until_time_elapsed_cancelled_alarm():
+    start = time.time()
+    samples = sample_until(sample_with_alarm_guard, duration_seconds=0.2)
+    elapsed = time.time() - start
+    assert 0.2 < elapsed < 0.5
+    assert len(samples) > 0
+
+
 def test_sample_until_time_elapsed_multiple_worker():
     start = time.time()
     samples = sample_until(sample, duration_seconds=2, num_workers=4)
@@ -28,18 +65,86 @@ def test_sample_until_time_elapsed_multiple_worker():
     assert 4 * 150 <= len(samples) <= 4 * 200
 
 
+@pytest.mark.skipif(not hasattr(signal, "setitimer"), reason="requires setitimer")
+def test_sample_until_time_elapsed_cancelled_alarm_multiple_worker():
+    # every worker process arms its own alarm
+    start = time.time()
+    samples = sample_until(sample_with_alarm_guard, duration_seconds=0.2, num_workers=2)
+    elapsed = time.time() - start
+    assert 0.2 < elapsed < 1.0
+    assert len(samples) > 0
+
+
 def test_sample_until_num_samples_one_worker():
     samples = sample_until(sample, num_samples=100)
     assert isinstance(samples, list)
     assert len(samples) == 100
 
 
+def test_sample_until_num_samples_with_duration_not_preallocated():
+    # `num_samples` is only an upper bound next to another condition
+    tracemalloc.start()
+    try:
+        samples = sample_until(lambda: 1, num_samples=10_000_000, duration_seconds=0.01)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(samples) < 10_000_000
+    assert peak < 10_000_000
+
+
 def test_sample_until_num_samples_multiple_worker():
     samples = sample_until(sample, num_samples=100, num_workers=4)
     assert isinstance(samples, list)
     assert len(samples) == 100
 
 
+def test_sample_until_num_samples_shared_between_workers():
+    # the workers claim samples from a shared budget, so the total is exact
+    samples = sample_until(sample, num_samples=100, num_workers=3)
+    assert len(samples) == 100
+
+
+def test_sample_until_reuse_pool():
+    samples = sample_until(sample, num_samples=100, num_workers=4, reuse_pool=True)
+    assert len(samples) == 100
+    # the second call runs on the same worker processes
+    samples = sample_until(sample, duration_seconds=0.5, num_workers=4, reuse_pool=True)
+    assert 4 * 30 <= len(samples) <= 4 * 50
+
+
+def test_sample_until_reuse_pool_generator():
+    # generators cannot be pickled, they are read into a list first
+    samples = sample_until(
+        sample_arg, f_args=(i for i in range(100)), num_workers=4, reuse_pool=True
+    )
+    assert sorted(samples) == list(range(100))
+
+
+def test_sample_until_reuse_pool_error():
+    with pytest.raises(ZeroDivisionError):
+        sample_until(fail, num_samples=10, num_workers=2, reuse_pool=True)
+    # the pool is still usable after a failed task
+    samples = sample_until(sample, num_samples=10, num_workers=2, reuse_pool=True)
+    assert len(samples) == 10
+
+
+def test_sample_until_pin_workers():
+    samples = sample_until(sample, num_samples=100, num_workers=2, pin_workers=True)
+    assert len(samples) == 100
+
+
+def test_sample_until_memory_percentage():
+    # memory usage is always above 0%, the first poll stops the sampling
+    samples = sample_until(sample, memory_percentage=0.0)
+    assert len(samples) == 1
+
+    # with multiprocessing, the parent shares the memory usage with the workers,
+    # which check the stopping conditions before their first sample
+    samples = sample_until(sample, memory_percentage=0.0, num_workers=2)
+    assert len(samples) == 0
+
+
 def test_sample_until_all_conditions():
     samples = sample_until(
         sample,
@@ -53,6 +158,22 @@ def test_sample_until_all_conditions():
     assert len(samples) == 100
 
 
+def test_sample_until_output_dtype():
+    samples = sample_until(sample, num_samples=100, output_dtype="d")
+    assert isinstance(samples, array)
+    assert samples.typecode == "d"
+    assert list(samples) == [1.0] * 100
+
+    samples = sample_until(sample, num_samples=100, num_workers=4, output_dtype="q")
+    assert isinstance(samples, array)
+    assert list(samples) == [1] * 100
+
+
+def test_sample_until_worker_error():
+    with pytest.raises(RuntimeError):
+        sample_until(lambda x: 1 / x, f_args=list(range(10)), num_workers=2)
+
+
 def test_sample_until_errors():
     # missing condition
     with pytest.raises(ValueError):
@@ -73,3 +194,11 @@ def test_sample_until_errors():
     # invalid memory_percentage
     with pytest.raises(ValueError):
         sample_until(sample, memory_percentage=80)
+
+    # invalid output_dtype
+    with pytest.raises(ValueError):
+        sample_until(sample, num_samples=10, output_dtype="x")
+
+    # the workers of a reused pool are not pinned
+    with pytest.raises(ValueError):
+        sample_until(sample, num_samples=10, reuse_pool=True, pin_workers=True)
@@ -1,6 +1,11 @@
+import functools
+import gc
+import weakref
+from collections import deque
+
 import pytest
 
-from sample_until.utils import _num_required_args
+from sample_until.utils import _num_required_args, split_f_args
 
 
 def f0():
@@ -23,6 +28,41 @@ def f4(x, *args, y=2, **kwargs):
     pass
 
 
-@pytest.mark.parametrize("fun,num_args", [(f0, 0), (f1, 1), (f2, 1), (f3, 2), (f4, 1)])
+def f5(x, *, y):
+    pass
+
+
+@functools.wraps(f1)
+def wrapped_f1(*args, **kwargs):
+    pass
+
+
+@pytest.mark.parametrize(
+    "fun,num_args",
+    [(f0, 0), (f1, 1), (f2, 1), (f3, 2), (f4, 1), (f5, 2), (wrapped_f1, 1)],
+)
 def test_num_required_args(fun, num_args):
     assert _num_required_args(fun) == num_args
+
+
+def test_num_required_args_releases_function():
+    def g(x):
+        return x
+
+    ref = weakref.ref(g)
+    assert _num_required_args(g) == 1
+    assert _num_required_args(g) == 1  # cached
+    del g
+    gc.collect()
+    assert ref() is None
+
+
+def test_split_f_args_sequence():
+    assert split_f_args(list(range(10)), 3) == [[0, 3, 6, 9], [1, 4, 7], [2, 5, 8]]
+    assert split_f_args(range(10), 2) == [range(0, 10, 2), range(1, 10, 2)]
+
+
+def test_split_f_args_deque():
+    # sequences without slicing support are distributed via islice
+    parts = split_f_args(deque(range(10)), 2)
+    assert [list(p) for p in parts] == [[0, 2, 4, 6, 8], [1, 3, 5, 7, 9]]